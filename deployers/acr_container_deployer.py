@@ -2,11 +2,14 @@ import io
 import os
 import subprocess
 import sys
+import tempfile
 import traceback
 
 from .container_deployer import ContainerDeployer
 from .helpers.advanced.storage_helper import StorageHelper
 from .helpers.advanced.registry_helper import ContainerRegistryHelper
+from .helpers.advanced.gc_helper import GarbageCollector
+from .helpers.output_helper import OutputPipeline
 
 SCRIPTS_DIR = os.path.join(os.path.dirname(__file__), 'scripts')
 
@@ -19,30 +22,25 @@ class ACRContainerDeployer(ContainerDeployer):
                  resource_group='containersample-group',
                  storage_account='containersample',
                  container_registry='containersample',
-                 container_service='containersample'):
+                 container_service='containersample',
+                 output_sinks=None,
+                 journal=None,
+                 keep_tunnel=False):
         super().__init__(client_data, docker_image,
                          location=location,
                          resource_group=resource_group,
-                         container_service=container_service)
+                         container_service=container_service,
+                         journal=journal,
+                         keep_tunnel=keep_tunnel)
         self.storage = StorageHelper(client_data, self.resources, storage_account)
         self.container_registry = ContainerRegistryHelper(
             client_data,
             self.resources,
             self.storage,
-            container_registry
+            container_registry,
+            output_sinks=output_sinks,
         )
-
-    def _format_proc_output(self, header, output):
-        if output:
-            print(
-                header,
-                '\n'.join([
-                    '    {}'.format(line)
-                    for line in output.decode('utf-8').split('\n')
-                ]),
-                sep='\n',
-                end='\n\n'
-            )
+        self.output_sinks = output_sinks
 
     def scp_to_cluster_master(self, local_path, remote_path):
         """Utility function to copy a file to the cluster's master node."""
@@ -69,36 +67,68 @@ class ACRContainerDeployer(ContainerDeployer):
         """
         print('Mounting file share on all machines in cluster...')
         key_file = os.path.basename(self.container_service.get_key_path())
-        with io.open(os.path.join(SCRIPTS_DIR, 'cifsMountTemplate.sh')) as cifsMount_template, \
-             io.open(os.path.join(SCRIPTS_DIR, 'cifsMount.sh'), 'w', newline='\n') as cifsMount:
-            cifsMount.write(
-                cifsMount_template.read().format(
-                    storageacct=self.storage.account.name,
-                    sharename=self.storage.default_share,
-                    username=self.container_registry.name,
-                    password=self.storage.key,
+        # Generate the script in a private dir: it holds this deploy's
+        # storage key, and other deploys may be running in the same process.
+        with tempfile.TemporaryDirectory() as temp_dir:
+            cifsMount_path = os.path.join(temp_dir, 'cifsMount.sh')
+            with io.open(os.path.join(SCRIPTS_DIR, 'cifsMountTemplate.sh')) as cifsMount_template, \
+                 io.open(cifsMount_path, 'w', newline='\n') as cifsMount:
+                cifsMount.write(
+                    cifsMount_template.read().format(
+                        storageacct=self.storage.account.name,
+                        sharename=self.storage.default_share,
+                        username=self.container_registry.name,
+                        password=self.storage.key,
+                    )
                 )
-            )
-        self.scp_to_cluster_master(os.path.join(SCRIPTS_DIR, 'cifsMount.sh'), '')
+            self.scp_to_cluster_master(cifsMount_path, '')
         self.scp_to_cluster_master(os.path.join(SCRIPTS_DIR, 'mountShares.sh'), '')
         self.scp_to_cluster_master(self.container_service.get_key_path(), key_file)
-        with self.container_service.cluster_ssh() as proc:
+        with self.container_service.cluster_ssh() as proc, \
+             OutputPipeline('mount', sinks=self.output_sinks) as output:
+            output.attach(proc.stdout, 'stdout')
+            output.attach(proc.stderr, 'stderr')
             proc.stdin.write('chmod 600 {}\n'.format(key_file).encode('ascii'))
             proc.stdin.write(b'eval ssh-agent -s\n')
             proc.stdin.write('ssh-add {}\n'.format(key_file).encode('ascii'))
             mountShares_cmd = 'sh mountShares.sh ~/{}\n'.format(key_file)
             print('Running mountShares on remote master. Cmd:', mountShares_cmd, sep='\n')
             proc.stdin.write(mountShares_cmd.encode('ascii'))
-            out, err = proc.communicate(input=b'exit\n')
+            proc.stdin.write(b'exit\n')
+            proc.stdin.close()
+            output.join()
+            returncode = proc.wait()
+        if returncode:
+            print('Mounting shares failed with exit code {}. Last output:'.format(returncode))
+            print(output.format_tail())
+            sys.exit(1)
         print('Finished mounting shares.')
-        self._format_proc_output('Stdout:', out)
-        self._format_proc_output('Stderr:', err)
 
     def deploy(self):
+        """Run each deploy phase, skipping those the journal marks as done."""
         registry_image_name = self.docker_image.split('/')[-1]
-        self.container_registry.setup_image(self.docker_image, registry_image_name)
-        self.mount_shares()
-        self.container_service.deploy_container(
-            private_registry_helper=self.container_registry
+        self.journal.run('registry', lambda: {
+            'login_server': self.container_registry.registry.login_server,
+        })
+        self.container_registry.setup_image(
+            self.docker_image, registry_image_name, journal=self.journal
         )
+        self.journal.run('mount', self.mount_shares)
+        self.journal.run('marathon', lambda: {
+            'deployment_id': self.container_service.deploy_container(
+                private_registry_helper=self.container_registry
+            ),
+        })
+        self.journal.finish()
 
+    def collect_garbage(self, keep=5, dry_run=False, share_pattern=None):
+        """Delete images and share files that no Marathon app references.
+
+        The newest `keep` images per repository and matching files in the
+        share are kept regardless. Only share files matching share_pattern
+        (by default the uploaded credentials archive) are considered.
+        Returns a GCReport.
+        """
+        collector = GarbageCollector(self.container_service, self.container_registry,
+                                     keep=keep, share_pattern=share_pattern)
+        return collector.collect(dry_run=dry_run)
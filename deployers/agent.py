@@ -0,0 +1,267 @@
+"""A long-lived local process that keeps deployers warm between runs.
+
+Building a deployer means creating SDK clients, resolving the resource
+group, registry and container service models, and opening an SSH tunnel
+to the cluster master. DeployAgent keeps those deployers around and
+serves requests over a Unix socket, so only the first deploy against a
+given target pays for that setup.
+
+The protocol is one JSON object per line in each direction. A request
+looks like {"command": "deploy", "args": {...}} and the reply is either
+{"ok": true, "result": ...} or {"ok": false, "error": "..."}.
+Supported commands are "deploy", "health" and "shutdown".
+"""
+
+import json
+import os
+import socket
+import socketserver
+import threading
+import time
+import traceback
+
+from .container_deployer import ContainerDeployer
+from .acr_container_deployer import ACRContainerDeployer
+from .helpers.journal_helper import DeployJournal
+
+
+DEFAULT_SOCKET_PATH = os.path.join(os.path.expanduser('~'), '.containersample-agent.sock')
+
+DEPLOYERS = {
+    deployer.__name__: deployer
+    for deployer in (ContainerDeployer, ACRContainerDeployer)
+}
+
+
+class AgentError(Exception):
+    """Raised by send_request when the agent reports a failure."""
+
+
+class _WarmDeployer(object):
+    """A cached deployer plus the lock that serializes its deploys.
+
+    deployer stays None until the first request for this target has
+    built it (under lock), so other targets aren't held up meanwhile.
+    """
+    def __init__(self):
+        self.deployer = None
+        self.lock = threading.Lock()
+        self.created = None
+        self.deploys = 0
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        agent = self.server.agent
+        for raw in self.rfile:
+            try:
+                request = json.loads(raw.decode('utf-8'))
+                result = agent.handle_request(request)
+                reply = {'ok': True, 'result': result}
+            except SystemExit:
+                # The helpers call sys.exit() after printing their own
+                # diagnostics; that must not take the whole agent down.
+                reply = {'ok': False, 'error': 'Deploy aborted; see agent output.'}
+            except Exception as exc:
+                traceback.print_exc()
+                reply = {'ok': False, 'error': '{}: {}'.format(type(exc).__name__, exc)}
+            self.wfile.write(json.dumps(reply).encode('utf-8') + b'\n')
+            self.wfile.flush()
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class DeployAgent(object):
+    """Serve deploy requests over a Unix socket using warm deployers.
+
+    Deployers are cached by deployer class and constructor options.
+    Requests for different targets run concurrently, each with its own
+    Docker config and generated scripts; requests for the same target
+    wait for each other, since they share a tunnel. A deployer whose
+    deploy fails is dropped and rebuilt on the next request, so stale
+    keys or a dead tunnel don't stick around. The agent exits after
+    idle_timeout seconds with no requests in flight (pass None to run
+    until told to shut down).
+
+    The socket is only accessible to the user running the agent, since
+    anyone who can connect can deploy with that user's credentials.
+    """
+    def __init__(self, client_data, socket_path=DEFAULT_SOCKET_PATH,
+                 idle_timeout=30 * 60):
+        self.client_data = client_data
+        self.socket_path = socket_path
+        self.idle_timeout = idle_timeout
+        self.started = time.time()
+        self.last_activity = self.started
+        self.requests_served = 0
+        self.active_requests = 0
+        self._deployers = {}
+        self._lock = threading.Lock()
+        self._server = None
+
+    def serve_forever(self):
+        if os.path.exists(self.socket_path):
+            if ping(self.socket_path):
+                raise RuntimeError('An agent is already listening on {}'.format(self.socket_path))
+            os.remove(self.socket_path)
+        # Create the socket as 0600 from the start; a chmod after bind
+        # would leave a window where other users could connect.
+        old_umask = os.umask(0o177)
+        try:
+            self._server = _Server(self.socket_path, _RequestHandler)
+        finally:
+            os.umask(old_umask)
+        self._server.agent = self
+        if self.idle_timeout is not None:
+            threading.Thread(target=self._watch_idle, daemon=True).start()
+        print('Deploy agent listening on', self.socket_path)
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+            os.remove(self.socket_path)
+            self.close()
+            print('Deploy agent stopped.')
+
+    def shutdown(self):
+        # BaseServer.shutdown() blocks until serve_forever() returns,
+        # so it can't be called from a request thread directly.
+        threading.Thread(target=self._server.shutdown, daemon=True).start()
+
+    def close(self):
+        with self._lock:
+            warm_deployers = list(self._deployers.values())
+            self._deployers = {}
+        for warm in warm_deployers:
+            if warm.deployer is not None:
+                warm.deployer.close()
+
+    def handle_request(self, request):
+        command = request.get('command')
+        handler = getattr(self, 'do_{}'.format(command), None)
+        if handler is None:
+            raise ValueError('Unknown command: {!r}'.format(command))
+        if command == 'health':
+            # Health checks don't count as activity, so a monitor
+            # polling the agent won't keep it alive forever.
+            return handler()
+        with self._lock:
+            self.active_requests += 1
+        try:
+            return handler(**request.get('args', {}))
+        finally:
+            with self._lock:
+                self.active_requests -= 1
+                self.requests_served += 1
+                self.last_activity = time.time()
+
+    def do_deploy(self, deployer, image, options, journal=None):
+        """Deploy image with a warm deployer, creating it if needed.
+
+        journal, if given, is a dict with "path", "target" and "resume"
+        keys used to build a DeployJournal for this request.
+        """
+        warm = self._get_deployer(deployer, options)
+        with warm.lock:
+            if warm.deployer is None:
+                print('Creating warm {} for {}'.format(deployer, options))
+                warm.deployer = DEPLOYERS[deployer](
+                    self.client_data, image, keep_tunnel=True, **options
+                )
+                warm.created = time.time()
+            warm.deployer.set_image(image)
+            if journal:
+                warm.deployer.journal = DeployJournal(
+                    journal['path'], journal['target'], resume=journal.get('resume', False)
+                )
+            else:
+                warm.deployer.journal = DeployJournal(None, {})
+            try:
+                warm.deployer.deploy()
+                public_ip = warm.deployer.public_ip()
+            except BaseException:
+                # Cached credentials, keys, models or the tunnel may be what
+                # failed; rebuild from scratch on the next request.
+                try:
+                    warm.deployer.close()
+                except Exception:
+                    traceback.print_exc()
+                warm.deployer = None
+                warm.created = None
+                raise
+            warm.deploys += 1
+            return {
+                'phases': warm.deployer.journal.phases,
+                'public_ip': public_ip,
+            }
+
+    def do_health(self):
+        now = time.time()
+        with self._lock:
+            return {
+                'pid': os.getpid(),
+                'uptime': now - self.started,
+                'idle': 0 if self.active_requests else now - self.last_activity,
+                'idle_timeout': self.idle_timeout,
+                'requests_served': self.requests_served,
+                'active_requests': self.active_requests,
+                'deployers': [
+                    {
+                        'deployer': key[0],
+                        'options': dict(key[1]),
+                        'warm': warm.deployer is not None,
+                        'age': now - warm.created if warm.created else 0,
+                        'deploys': warm.deploys,
+                        'tunnel_open': warm.deployer is not None and
+                        warm.deployer.container_service._tunnel is not None,
+                    }
+                    for key, warm in self._deployers.items()
+                ],
+            }
+
+    def do_shutdown(self):
+        self.shutdown()
+        return 'Shutting down.'
+
+    def _get_deployer(self, deployer, options):
+        if deployer not in DEPLOYERS:
+            raise ValueError('Unknown deployer: {!r}'.format(deployer))
+        key = (deployer, tuple(sorted(options.items())))
+        with self._lock:
+            if key not in self._deployers:
+                self._deployers[key] = _WarmDeployer()
+            return self._deployers[key]
+
+    def _watch_idle(self):
+        while True:
+            time.sleep(min(self.idle_timeout, 30))
+            with self._lock:
+                idle = not self.active_requests and \
+                    time.time() - self.last_activity > self.idle_timeout
+            if idle:
+                print('Deploy agent idle for {} seconds; exiting.'.format(self.idle_timeout))
+                self.shutdown()
+                return
+
+
+def send_request(socket_path, command, **args):
+    """Send one request to a running agent and return its result."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        with sock.makefile('rwb') as stream:
+            stream.write(json.dumps({'command': command, 'args': args}).encode('utf-8') + b'\n')
+            stream.flush()
+            reply = json.loads(stream.readline().decode('utf-8'))
+    if not reply['ok']:
+        raise AgentError(reply['error'])
+    return reply['result']
+
+
+def ping(socket_path):
+    """Return the agent's health report, or None if no agent is listening."""
+    try:
+        return send_request(socket_path, 'health')
+    except (OSError, ValueError):
+        return None
@@ -1,5 +1,6 @@
 from .helpers.resource_helper import ResourceHelper
 from .helpers.container_helper import ContainerServiceHelper
+from .helpers.journal_helper import DeployJournal
 
 
 class ContainerDeployer(object):
@@ -9,18 +10,34 @@ class ContainerDeployer(object):
                  location='South Central US',
                  container_service='containersample',
                  resource_group='containersample-group',
+                 journal=None,
+                 keep_tunnel=False,
                  **kw):
         self.docker_image = docker_image
+        self.journal = journal or DeployJournal(None, {})
         self.resources = ResourceHelper(client_data, location, resource_group)
         self.resources.resource_client.providers.register('Microsoft.ContainerRegistry')
         self.resources.resource_client.providers.register('Microsoft.ContainerService')
         self.container_service = ContainerServiceHelper(client_data,
                                                         self.resources,
                                                         container_service,
-                                                        self.docker_image)
+                                                        self.docker_image,
+                                                        keep_tunnel=keep_tunnel)
+
+    def set_image(self, docker_image):
+        """Point this deployer at a different image, keeping its clients."""
+        self.docker_image = docker_image
+        self.container_service.docker_tag = docker_image
+
+    def close(self):
+        """Release anything held open between deploys."""
+        self.container_service.close_tunnel()
 
     def deploy(self):
-        self.container_service.deploy_container()
+        self.journal.run('marathon', lambda: {
+            'deployment_id': self.container_service.deploy_container(),
+        })
+        self.journal.finish()
 
     def public_ip(self):
         """Get the IP address for the public agent in the container service."""
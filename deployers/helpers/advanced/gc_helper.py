@@ -0,0 +1,286 @@
+"""Remove registry images and share files that nothing uses anymore."""
+
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from fnmatch import fnmatch
+import traceback
+
+
+# One deletable thing: a registry manifest (with all its tags) or a share file.
+Candidate = namedtuple('Candidate', ['kind', 'location', 'name', 'tags', 'size'])
+
+TAGS_ONLY_NOTE = (
+    'This registry does not support listing manifests (/acr/v1), so only '
+    'tagged images were considered; untagged manifests left behind by '
+    're-pushed tags were not collected.'
+)
+
+
+def _format_size(size):
+    for unit in ('B', 'KiB', 'MiB'):
+        if size < 1024:
+            return '{:.1f} {}'.format(size, unit)
+        size /= 1024.0
+    return '{:.1f} GiB'.format(size)
+
+
+class GCReport(object):
+    """What a garbage collection run deleted, or would have deleted."""
+    def __init__(self, dry_run):
+        self.dry_run = dry_run
+        self.candidates = []
+        self.deleted = []
+        self.failed = []
+        self.kept = 0
+        self.notes = set()
+
+    @property
+    def reclaimed(self):
+        """Bytes freed by deleted items (or that would be freed, on a dry run)."""
+        items = self.candidates if self.dry_run else self.deleted
+        return sum(item.size for item in items)
+
+    def print_summary(self):
+        verb = 'Would delete' if self.dry_run else 'Deleted'
+        items = self.candidates if self.dry_run else self.deleted
+        for item in items:
+            print('    {} {} {}/{}{} ({})'.format(
+                verb, item.kind, item.location, item.name,
+                ''.join(' ' + tag for tag in item.tags), _format_size(item.size),
+            ))
+        for item, error in self.failed:
+            print('    Failed to delete {} {}/{}: {}'.format(
+                item.kind, item.location, item.name, error
+            ))
+        print('{} {} items, kept {}, {} reclaimed.'.format(
+            verb, len(items), self.kept, _format_size(self.reclaimed)
+        ))
+        for note in sorted(self.notes):
+            print('Note:', note)
+
+
+class GarbageCollector(object):
+    """Delete registry manifests and share files Marathon no longer uses.
+
+    Anything referenced by a running Marathon app is kept: the app's
+    Docker image, its file:///mnt/<share>/ URIs, and its volumes whose
+    host path is under /mnt/<share>. On top of that the newest `keep`
+    images per repository and the newest `keep` matching share files are
+    kept. Everything else is deleted, using up to `workers` threads.
+
+    Images are found through ACR's manifest listing, which includes the
+    untagged manifests left behind whenever a tag is pushed again; those
+    count towards `keep` like any other image. On registries without
+    that API only tagged images are seen, and the report says so.
+
+    Only share files whose names match share_pattern are considered.
+    It defaults to the credentials archive this tool uploads, so files
+    that apps keep in the share are never touched unless asked for.
+    Images whose manifests aren't schema 2 can't be dated or sized,
+    so they are always kept.
+
+    Registry sizes count each layer once, and only if no kept image uses
+    it. The registry frees the storage on its own schedule, so treat the
+    registry part of the reclaimed total as an estimate.
+    """
+    def __init__(self, container_service, registry_helper, keep=5, workers=8,
+                 share_pattern=None):
+        self.container_service = container_service
+        self.registry = registry_helper
+        self.storage = registry_helper.storage
+        self.keep = keep
+        self.workers = workers
+        self.share_pattern = share_pattern or registry_helper.credentials_file_name
+
+    def collect(self, dry_run=False):
+        print('Collecting garbage{}...'.format(' (dry run)' if dry_run else ''))
+        report = GCReport(dry_run)
+        images, files = self.referenced()
+        with ThreadPoolExecutor(self.workers) as executor:
+            self._plan_registry(executor, images, report)
+            self._plan_share(executor, files, report)
+            if not dry_run:
+                list(executor.map(
+                    lambda item: self._delete(item, report), report.candidates
+                ))
+        report.print_summary()
+        return report
+
+    def referenced(self):
+        """Get the (repository, tag or digest) images and share files in use.
+
+        Share files are given by their top-level name in the share, so a
+        volume on /mnt/<share>/data keeps everything under "data". If an
+        app uses the whole share, the files set contains "".
+        """
+        images = set()
+        files = set()
+        login_server = self.registry.registry.login_server
+        mount_path = '/mnt/{}'.format(self.storage.default_share)
+        for app in self.container_service.marathon_apps():
+            container = app.get('container') or {}
+            image = (container.get('docker') or {}).get('image', '')
+            if image.startswith(login_server + '/'):
+                images.add(_split_image(image[len(login_server) + 1:]))
+            paths = [volume.get('hostPath', '') for volume in container.get('volumes') or []]
+            uris = list(app.get('uris') or [])
+            uris.extend(fetch['uri'] for fetch in app.get('fetch') or [])
+            paths.extend(uri[len('file://'):] for uri in uris if uri.startswith('file://'))
+            for path in paths:
+                path = path.rstrip('/')
+                if path == mount_path:
+                    files.add('')
+                elif path.startswith(mount_path + '/'):
+                    files.add(path[len(mount_path) + 1:].split('/')[0])
+        return images, files
+
+    def _plan_registry(self, executor, images, report):
+        by_digest = {}
+        for repository in self.registry.list_repositories():
+            for entry in self._list_images(executor, repository, report):
+                by_digest[(repository, entry['digest'])] = entry
+
+        keep = set()
+        by_repository = {}
+        for key, entry in by_digest.items():
+            by_repository.setdefault(entry['repository'], []).append(entry)
+            references = {(entry['repository'], ref) for ref in entry['tags'] + [entry['digest']]}
+            if references & images:
+                keep.add(key)
+        for entries in by_repository.values():
+            entries.sort(key=lambda entry: entry['created'], reverse=True)
+            for entry in entries[:self.keep]:
+                keep.add((entry['repository'], entry['digest']))
+
+        kept_layers = set()
+        for key in keep:
+            kept_layers.update(by_digest[key]['layers'])
+        report.kept += len(keep)
+        counted = set()
+        for key, entry in sorted(by_digest.items()):
+            if key in keep:
+                continue
+            freed = {
+                digest: size for digest, size in entry['layers'].items()
+                if digest not in kept_layers and digest not in counted
+            }
+            counted.update(freed)
+            report.candidates.append(Candidate(
+                'image', entry['repository'], entry['digest'],
+                entry['tags'], sum(freed.values()),
+            ))
+
+    def _list_images(self, executor, repository, report):
+        """Describe every image in a repository that can be collected.
+
+        Each entry has the repository, digest, tags, creation time and
+        blob sizes. Manifests that can't be described are reported as
+        kept and left out.
+        """
+        manifests = self.registry.list_manifests(repository)
+        if manifests is None:
+            report.notes.add(TAGS_ONLY_NOTE)
+            return self._list_tagged_images(executor, repository, report)
+        described = list(executor.map(
+            lambda manifest: self._describe_image(repository, manifest['digest']),
+            manifests
+        ))
+        entries = []
+        for manifest, entry in zip(manifests, described):
+            if entry is None:
+                self._keep_unknown(repository, manifest['digest'], report)
+                continue
+            entry.update(
+                repository=repository,
+                tags=manifest.get('tags') or [],
+                created=manifest.get('createdTime', ''),
+            )
+            entries.append(entry)
+        return entries
+
+    def _list_tagged_images(self, executor, repository, report):
+        tags = self.registry.list_tags(repository)
+        described = list(executor.map(
+            lambda tag: self._describe_image(repository, tag, read_created=True),
+            tags
+        ))
+        by_digest = {}
+        for tag, entry in zip(tags, described):
+            if entry is None:
+                self._keep_unknown(repository, tag, report)
+                continue
+            by_digest.setdefault(entry['digest'], dict(
+                entry, repository=repository, tags=[],
+            ))['tags'].append(tag)
+        return list(by_digest.values())
+
+    def _describe_image(self, repository, reference, read_created=False):
+        """Get the digest and blob sizes of an image, by tag or digest.
+
+        With read_created, also read its creation time from the config
+        blob. Returns None for manifests that aren't schema 2 (schema 1
+        or manifest lists), which have no config blob to size or date.
+        """
+        manifest = self.registry.get_manifest(repository, reference)
+        config = manifest.get('config') or {}
+        if not manifest.get('digest') or not config.get('digest'):
+            return None
+        blobs = [config] + manifest.get('layers', [])
+        entry = {
+            'digest': manifest['digest'],
+            'layers': {blob['digest']: blob.get('size', 0) for blob in blobs if 'digest' in blob},
+        }
+        if read_created:
+            entry['created'] = self.registry.get_blob(
+                repository, config['digest']
+            ).json().get('created', '')
+        return entry
+
+    @staticmethod
+    def _keep_unknown(repository, reference, report):
+        print('    Keeping {} {}: not a schema 2 image manifest.'.format(repository, reference))
+        report.kept += 1
+
+    def _plan_share(self, executor, referenced_files, report):
+        if '' in referenced_files:
+            print('    Keeping share {}: an app uses all of it.'.format(self.storage.default_share))
+            return
+        files = [
+            item for item in self.storage.list_files()
+            if fnmatch(item.name, self.share_pattern)
+        ]
+        modified = list(executor.map(
+            lambda item: self.storage.get_file_properties(item.name).last_modified,
+            files
+        ))
+        by_age = sorted(zip(files, modified), key=lambda pair: pair[1], reverse=True)
+        for index, (item, _) in enumerate(by_age):
+            if index < self.keep or item.name in referenced_files:
+                report.kept += 1
+                continue
+            report.candidates.append(Candidate(
+                'file', self.storage.default_share, item.name, [],
+                item.properties.content_length or 0,
+            ))
+
+    def _delete(self, item, report):
+        try:
+            if item.kind == 'image':
+                self.registry.delete_manifest(item.location, item.name)
+            else:
+                self.storage.delete_file(item.name)
+        except Exception as exc:
+            traceback.print_exc()
+            report.failed.append((item, exc))
+        else:
+            report.deleted.append(item)
+
+
+def _split_image(name):
+    """Split "repo:tag" or "repo@digest" into (repo, reference)."""
+    if '@' in name:
+        return tuple(name.split('@', 1))
+    repository, _, tag = name.rpartition(':')
+    if not repository or '/' in tag:
+        return (name, 'latest')
+    return (repository, tag)
@@ -1,9 +1,13 @@
+import json
 import os
+import re
 import subprocess
+import sys
 import tarfile
 import tempfile
 from collections import namedtuple
 from contextlib import contextmanager
+from urllib.parse import urljoin
 from distutils.spawn import find_executable
 
 from azure.mgmt.containerregistry import (
@@ -16,31 +20,32 @@ from azure.mgmt.containerregistry.models import (
     SkuTier as ContainerRegistrySkuName
 )
 
+import requests
 from msrestazure.azure_exceptions import CloudError
 
+from ..journal_helper import DeployJournal
+from ..output_helper import OutputPipeline
+
 
 LoginCredentials = namedtuple('LoginCredentials', ['user', 'password'])
 
+DIGEST_PATTERN = re.compile(r'digest: (sha256:[0-9a-f]+)')
 
-@contextmanager
-def working_dir(path):
-    """Switch the working dir to a given dir temporarily."""
-    starting_path = os.getcwd()
-    os.chdir(path)
-    yield
-    os.chdir(starting_path)
+MANIFEST_V2 = 'application/vnd.docker.distribution.manifest.v2+json'
 
 
 class ContainerRegistryHelper(object):
     """Manage an Azure Container Registry."""
     def __init__(self, client_data, resource_helper, storage,
-                 name='containersample'):
+                 name='containersample', output_sinks=None):
         self.resources = resource_helper
         self.storage = storage
         self.name = name
         self._registry = None
         self._credentials = None
         self.credentials_file_name = 'docker.tar.gz'
+        self.output_sinks = output_sinks
+        self.docker_config = None
         self.registry_client = ContainerRegistryManagementClient(*client_data)
 
     @property
@@ -111,28 +116,85 @@ class ContainerRegistryHelper(object):
         This uses the Docker CLI rather than the Python module,
         as the module claims not to modify the Docker config.json,
         which we need for credential distribution to the cluster.
+
+        The login goes into a temporary DOCKER_CONFIG directory
+        (self.docker_config) rather than ~/.docker, so sessions for
+        different registries in one process don't see each other's logins.
         """
-        print('Logging into Docker registry...')
-        subprocess.check_call([
-            'docker', 'login',
-            '-u', self.credentials.user,
-            '-p', self.credentials.password,
-            self.registry.login_server,
-        ])
-        yield
-        print('Logging out of Docker registry.')
-        subprocess.check_call(['docker', 'logout',
-                               self.registry.login_server])
+        with tempfile.TemporaryDirectory(prefix='docker-config-') as docker_config:
+            self.docker_config = docker_config
+            try:
+                self._seed_docker_config()
+                print('Logging into Docker registry...')
+                subprocess.check_call([
+                    'docker', 'login',
+                    '-u', self.credentials.user,
+                    '-p', self.credentials.password,
+                    self.registry.login_server,
+                ], env=self._docker_env())
+                self._check_docker_config()
+                yield
+                print('Logging out of Docker registry.')
+                subprocess.check_call(['docker', 'logout',
+                                       self.registry.login_server],
+                                      env=self._docker_env())
+            finally:
+                self.docker_config = None
+
+    def _docker_env(self):
+        return dict(os.environ, DOCKER_CONFIG=self.docker_config)
+
+    def _docker_config_path(self):
+        return os.path.join(self.docker_config, 'config.json')
+
+    def _seed_docker_config(self):
+        """Write a config.json that keeps docker login out of credential stores.
+
+        With no auths in config.json, the Docker CLI falls back to the
+        platform's credential store (osxkeychain, wincred, desktop), and the
+        login never reaches the config we upload to the cluster. An entry
+        for the registry is enough to stop that lookup.
+        """
+        with open(self._docker_config_path(), 'w') as config_file:
+            json.dump({'auths': {self.registry.login_server: {}}}, config_file)
+
+    def _check_docker_config(self):
+        with open(self._docker_config_path()) as config_file:
+            auths = json.load(config_file).get('auths', {})
+        if not auths.get(self.registry.login_server, {}).get('auth'):
+            print('docker login did not store credentials for {} in {}.'.format(
+                self.registry.login_server, self._docker_config_path()
+            ))
+            print('The cluster needs them there to pull from the registry.')
+            print('Check that your Docker CLI is not configured to use a credential store.')
+            sys.exit(1)
 
     def _push_to_registry(self, image_name, image_name_in_repo):
+        """Push an image and return the digest the registry reported for it."""
         print('Pushing image {}...'.format(image_name))
         repository_tag = self.get_docker_repo_tag(image_name_in_repo)
         subprocess.check_call(['docker', 'tag', image_name, repository_tag])
         push_proc = subprocess.Popen(['docker', 'push', repository_tag],
-                                     stdout=subprocess.PIPE)
-        for line in iter(push_proc.stdout.readline, b''):
-            print(line.decode('utf-8'), end='')
+                                     stdout=subprocess.PIPE,
+                                     stderr=subprocess.PIPE,
+                                     env=self._docker_env())
+        digests = []
+
+        def find_digest(line):
+            match = DIGEST_PATTERN.search(line.text)
+            if match:
+                digests.append(match.group(1))
+
+        with OutputPipeline('push', sinks=self.output_sinks) as output:
+            output.add_sink(find_digest)
+            output.attach(push_proc.stdout, 'stdout')
+            output.attach(push_proc.stderr, 'stderr')
+        if push_proc.wait():
+            print('Push failed. Last output:')
+            print(output.format_tail())
+            raise subprocess.CalledProcessError(push_proc.returncode, push_proc.args)
         print('Push finished.')
+        return digests[-1] if digests else None
 
     def _upload_docker_creds(self):
         """Upload credentials for a Docker registry to an Azure share.
@@ -140,22 +202,96 @@ class ContainerRegistryHelper(object):
         Official docs on this process:
         https://docs.microsoft.com/en-us/azure/container-service/container-service-dcos-acr
 
-        This relies on Docker storing credentials in ~/.docker/config.json.
-        That doesn't happen if there is a "credsStore" entry there.
-        You need to remove it!
+        This must run inside docker_session(), which makes sure the
+        login is stored in the session's config.json.
         """
         print('Uploading Docker credentials...')
         with tempfile.TemporaryDirectory() as temp_dir:
             creds_path = os.path.join(temp_dir, self.credentials_file_name)
             with tarfile.open(creds_path, mode='w:gz') as creds_file:
-                with working_dir(os.environ['HOME']):
-                    creds_file.add('.docker')
+                creds_file.add(self.docker_config, arcname='.docker')
             share_path = self.storage.upload_file(creds_path)
         print('Docker credentials uploaded to share at', share_path)
+        return share_path
 
-    def setup_image(self, image_name, image_name_in_repo):
-        """Push an image to a registry and put the registry credentials on a share."""
-        with self.docker_session():
-            self._push_to_registry(image_name, image_name_in_repo)
-            self._upload_docker_creds()
+    def registry_api(self, method, path, **kwargs):
+        """Make a request against the registry's Docker Registry v2 API.
 
+        path is relative to /v2/, or an absolute path such as the ones
+        the registry sends back in Link headers.
+        """
+        response = requests.request(
+            method,
+            urljoin('https://{}/v2/'.format(self.registry.login_server), path),
+            auth=self.credentials,
+            **kwargs
+        )
+        response.raise_for_status()
+        return response
+
+    def _list_all(self, path, key, page_size=100):
+        """Collect a paginated list, following Link: <...>; rel="next" headers."""
+        items = []
+        response = self.registry_api('GET', path, params={'n': page_size})
+        while True:
+            items.extend(response.json().get(key) or [])
+            next_page = response.links.get('next')
+            if not next_page:
+                return items
+            response = self.registry_api('GET', next_page['url'])
+
+    def list_repositories(self):
+        return self._list_all('_catalog', 'repositories')
+
+    def list_tags(self, repository):
+        return self._list_all('{}/tags/list'.format(repository), 'tags')
+
+    def list_manifests(self, repository):
+        """List every manifest in a repository, tagged or not.
+
+        This uses ACR's own /acr/v1 API, since the standard v2 API only
+        lists tags. Each entry has at least "digest", "tags" and
+        "createdTime". Returns None if the registry doesn't support it.
+        """
+        try:
+            return self._list_all('/acr/v1/{}/_manifests'.format(repository), 'manifests')
+        except requests.HTTPError as exc:
+            if exc.response is not None and exc.response.status_code == 404:
+                return None
+            raise
+
+    def get_manifest(self, repository, reference):
+        """Get a manifest by tag or digest, with its digest filled in."""
+        response = self.registry_api(
+            'GET', '{}/manifests/{}'.format(repository, reference),
+            headers={'Accept': MANIFEST_V2},
+        )
+        manifest = response.json()
+        manifest['digest'] = response.headers.get('Docker-Content-Digest')
+        return manifest
+
+    def get_blob(self, repository, digest):
+        return self.registry_api('GET', '{}/blobs/{}'.format(repository, digest))
+
+    def delete_manifest(self, repository, digest):
+        """Delete a manifest, and with it every tag pointing at it."""
+        self.registry_api('DELETE', '{}/manifests/{}'.format(repository, digest))
+
+    def setup_image(self, image_name, image_name_in_repo, journal=None):
+        """Push an image to a registry and put the registry credentials on a share.
+
+        If a DeployJournal is given, the "push" and "credentials" phases
+        are recorded in it, and skipped if it says they already finished.
+        """
+        journal = journal or DeployJournal(None, {})
+        if journal.done('push') and journal.done('credentials'):
+            return
+        # Credentials are read from the Docker config written by login,
+        # so both phases need to run inside the same session.
+        with self.docker_session():
+            journal.run('push', lambda: {
+                'digest': self._push_to_registry(image_name, image_name_in_repo),
+            })
+            journal.run('credentials', lambda: {
+                'share_path': self._upload_docker_creds(),
+            })
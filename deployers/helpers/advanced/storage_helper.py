@@ -12,6 +12,7 @@ from azure.mgmt.storage.models import (
     Kind as StorageKind
 )
 from azure.storage.file import FileService
+from azure.storage.file.models import File
 from msrestazure.azure_exceptions import CloudError
 
 
@@ -34,6 +35,7 @@ class StorageHelper(object):
         self.default_share = default_share
         self._account = account
         self._key = os.environ.get('AZURE_STORAGE_KEY')
+        self._file_service = None
         self.resource_helper = resource_helper
         self.client = StorageManagementClient(*client_data)
 
@@ -88,17 +90,23 @@ class StorageHelper(object):
             self._key = next(iter(storage_keys.keys)).value
         return self._key
 
+    @property
+    def file_service(self):
+        """Get a FileService client for the managed storage account."""
+        if self._file_service is None:
+            self._file_service = FileService(
+                account_name=self.account.name,
+                account_key=self.key,
+            )
+        return self._file_service
+
     def upload_file(self, path):
         """Upload a file into the default share on the storage account.
 
         If the share doesn't exist, create it first.
         """
-        file_service = FileService(
-            account_name=self.account.name,
-            account_key=self.key,
-        )
-        file_service.create_share(self.default_share)
-        file_service.create_file_from_path(
+        self.file_service.create_share(self.default_share)
+        self.file_service.create_file_from_path(
             self.default_share,
             None,
             os.path.basename(path),
@@ -106,3 +114,18 @@ class StorageHelper(object):
         )
         return '/'.join([self.default_share, os.path.basename(path)])
 
+    def list_files(self):
+        """List the files at the top level of the default share."""
+        return [
+            item for item in
+            self.file_service.list_directories_and_files(self.default_share)
+            if isinstance(item, File)
+        ]
+
+    def get_file_properties(self, file_name):
+        return self.file_service.get_file_properties(
+            self.default_share, None, file_name
+        ).properties
+
+    def delete_file(self, file_name):
+        self.file_service.delete_file(self.default_share, None, file_name)
@@ -28,11 +28,14 @@ from msrestazure.azure_exceptions import CloudError
 
 class ContainerServiceHelper(object):
     """Manage an Azure Container Service."""
-    def __init__(self, client_data, resource_helper, name, docker_tag):
+    def __init__(self, client_data, resource_helper, name, docker_tag,
+                 keep_tunnel=False):
         self.resources = resource_helper
         self.name = name
         self.docker_tag = docker_tag
+        self.keep_tunnel = keep_tunnel
         self._container_service = None
+        self._tunnel = None
         self.container_client = ContainerServiceClient(*client_data)
 
     @property
@@ -121,20 +124,55 @@ class ContainerServiceHelper(object):
             ssh_pkey=self.get_key_path(),
         )
 
+    @contextmanager
+    def marathon_tunnel(self, **tunnel_args):
+        """Open an SSH tunnel to Marathon inside a with block.
+
+        If keep_tunnel is set, the tunnel is left open afterwards and
+        reused by later calls for as long as it stays active.
+        Call close_tunnel() to shut it down.
+        """
+        if not self.keep_tunnel:
+            with SSHTunnelForwarder(**self.ssh_tunnel_args(**tunnel_args)) as tunnel:
+                yield tunnel
+            return
+        if self._tunnel is None or not self._tunnel.is_active:
+            self.close_tunnel()
+            # Let the OS pick the local port so warm tunnels to
+            # several clusters can be open at the same time.
+            tunnel_args['local_port'] = 0
+            print('Opening persistent SSH tunnel to', self.master_ssh_address())
+            tunnel = SSHTunnelForwarder(**self.ssh_tunnel_args(**tunnel_args))
+            tunnel.start()
+            self._tunnel = tunnel
+        yield self._tunnel
+
+    def close_tunnel(self):
+        if self._tunnel is not None:
+            self._tunnel.stop()
+            self._tunnel = None
+
     @contextmanager
     def cluster_ssh(self):
         """Open a ssh connection to the cluster master as a subprocess."""
         try:
             cmd = ['ssh', '-i', self.get_key_path(), self.master_ssh_login()]
             print('Connecting to cluster:', ' '.join(cmd))
-            proc = subprocess.Popen(cmd, stdin=PIPE, stdout=PIPE)
+            proc = subprocess.Popen(cmd, stdin=PIPE, stdout=PIPE, stderr=PIPE)
         except subprocess.CalledProcessError:
             print('Your SSH connection to the cluster was unsuccessful. '
                   'Try `ssh {}` to confirm that you can do so '
                   'without any prompts.'.format(self.master_ssh_login()))
             raise
-        yield proc
-        proc.terminate()
+        try:
+            yield proc
+        finally:
+            try:
+                proc.stdin.close()
+            except OSError:
+                # BrokenPipeError if ssh already went away.
+                pass
+            proc.terminate()
 
     def deployment_id(self):
         return self.docker_tag.split('/')[-1]
@@ -171,23 +209,38 @@ class ContainerServiceHelper(object):
             ]
         return params
 
+    def marathon_apps(self):
+        """List the apps Marathon is currently running."""
+        with self.marathon_tunnel(
+            remote_host='127.0.0.1',
+            local_host='127.0.0.1',
+            remote_port=80,
+            local_port=8001,
+        ) as tunnel:
+            base_url = 'http://{}:{}/marathon/v2/'.format(*tunnel.local_bind_address)
+            response = requests.get(base_url + 'apps')
+            response.raise_for_status()
+            return response.json()['apps']
+
     def deploy_container(self, private_registry_helper=None):
         """Deploy a Docker container to the container service.
 
         If a ContainerRegistryHelper is passed for private_registry_helper,
         it will be used to deploy from a private container registry
         rather than using a local image.
+
+        Return the ID of the Marathon deployment, if one was started.
         """
         tunnel_remote_port = 80
         tunnel_local_port = 8001
         tunnel_host = '127.0.0.1'
         try:
-            with SSHTunnelForwarder(**self.ssh_tunnel_args(
+            with self.marathon_tunnel(
                 remote_host=tunnel_host,
                 local_host=tunnel_host,
                 remote_port=tunnel_remote_port,
                 local_port=tunnel_local_port,
-            )) as tunnel:
+            ) as tunnel:
                 base_url = 'http://{}:{}/marathon/v2/'.format(*tunnel.local_bind_address)
                 print('Attempting to deploy Docker image {}'.format(self.docker_tag))
                 response = requests.post(
@@ -196,8 +249,11 @@ class ContainerServiceHelper(object):
                 )
                 content = response.json()
                 print('Deployment request successful.')
+                marathon_deployment_id = None
                 if 'deployments' in content:
                     print('Deployments: ', content['deployments'])
+                    if content['deployments']:
+                        marathon_deployment_id = content['deployments'][0]['id']
                 else:
                     print(content)
                 while True:
@@ -208,6 +264,7 @@ class ContainerServiceHelper(object):
                         time.sleep(5)
                     else:
                         break
+                return marathon_deployment_id
         except HandlerSSHTunnelForwarderError:
             traceback.print_exc()
             print('Opening SSH tunnel failed.')
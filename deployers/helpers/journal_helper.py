@@ -0,0 +1,75 @@
+"""Record completed deploy phases so a failed deploy can be resumed."""
+
+import io
+import json
+import os
+
+
+class DeployJournal(object):
+    """A small JSON file of the deploy phases that finished and their outputs.
+
+    The journal is tied to a target, a dict such as the image and resource
+    group being deployed. It is only loaded from disk when resume is True
+    and the stored target matches; otherwise it starts out empty and the
+    file is overwritten as phases complete. With path=None nothing is
+    written, which is what deployers use when no journal is given.
+
+    Once a deploy has run all its phases it calls finish(); a finished
+    journal is not resumed, so the next run deploys again from scratch.
+    """
+    def __init__(self, path, target, resume=False):
+        self.path = path
+        self.target = target
+        self.phases = {}
+        self.finished = False
+        if resume and path and os.path.exists(path):
+            with io.open(path) as journal_file:
+                data = json.load(journal_file)
+            if data.get('finished'):
+                print('Previous deploy in {} finished; starting over.'.format(path))
+            elif data.get('target') == target:
+                self.phases = data.get('phases', {})
+                print('Resuming deploy; completed phases:', ', '.join(self.phases) or 'none')
+            else:
+                print('Journal at {} is for a different deploy; starting over.'.format(path))
+
+    def done(self, phase):
+        return phase in self.phases
+
+    def outputs(self, phase):
+        return self.phases.get(phase, {})
+
+    def record(self, phase, **outputs):
+        """Mark a phase as completed and save the journal."""
+        self.phases[phase] = outputs
+        self._save()
+
+    def finish(self):
+        """Mark the whole deploy as done, so it won't be resumed."""
+        self.finished = True
+        self._save()
+
+    def run(self, phase, func):
+        """Run func for a phase unless the journal says it already finished.
+
+        func should return a dict of outputs worth keeping (or None).
+        """
+        if self.done(phase):
+            print('Skipping {} phase, already completed: {}'.format(phase, self.outputs(phase)))
+            return self.outputs(phase)
+        outputs = func() or {}
+        self.record(phase, **outputs)
+        return outputs
+
+    def _save(self):
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        temp_path = self.path + '.tmp'
+        with io.open(temp_path, 'w') as journal_file:
+            json.dump({
+                'target': self.target,
+                'phases': self.phases,
+                'finished': self.finished,
+            }, journal_file, indent=2)
+        os.replace(temp_path, self.path)
@@ -0,0 +1,104 @@
+"""Stream output from subprocesses line by line, with bounded memory."""
+
+import threading
+import traceback
+from collections import deque, namedtuple
+
+
+OutputLine = namedtuple('OutputLine', ['stream', 'tag', 'text'])
+
+PHASE_MARKER = '### '
+
+
+def print_sink(line):
+    """Default sink: print each line indented under its tag."""
+    print('    [{}:{}] {}'.format(line.tag, line.stream, line.text))
+
+
+class OutputPipeline(object):
+    """Read several byte streams concurrently and fan lines out to sinks.
+
+    Each attached stream gets its own reader thread, so a process that
+    fills its stderr pipe while we wait on stdout can't deadlock us.
+    Lines are decoded, tagged and handed to every sink as an OutputLine
+    namedtuple. A line starting with PHASE_MARKER is not forwarded;
+    instead the rest of it becomes the tag for the following lines on
+    that stream, which lets remote scripts announce the node or phase
+    they are working on.
+
+    Only the last tail_lines lines per tag are kept, for error reports.
+    A sink that raises is reported and removed; reading carries on.
+    Use it as a context manager so the reader threads are joined on exit.
+    """
+    def __init__(self, tag, sinks=None, tail_lines=50):
+        self.tag = tag
+        self.sinks = list(sinks) if sinks is not None else [print_sink]
+        self.tail_lines = tail_lines
+        self._tails = {}
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        # If the block failed, the process feeding us may still be running
+        # with its pipes open; joining would wait for it forever.
+        if exc_type is None:
+            self.join()
+
+    def add_sink(self, sink):
+        """Register a callable taking an OutputLine."""
+        self.sinks.append(sink)
+
+    def attach(self, stream, name):
+        """Start reading a binary stream (e.g. proc.stdout) in the background."""
+        thread = threading.Thread(target=self._read, args=(stream, name), daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def join(self):
+        """Wait for all attached streams to reach EOF."""
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def tail(self, tag=None):
+        """Get the retained lines for one tag, or for every tag in order seen."""
+        with self._lock:
+            if tag is not None:
+                return list(self._tails.get(tag, ()))
+            return [line for lines in self._tails.values() for line in lines]
+
+    def format_tail(self, tag=None):
+        return '\n'.join(
+            '    [{}:{}] {}'.format(line.tag, line.stream, line.text)
+            for line in self.tail(tag)
+        )
+
+    def _read(self, stream, name):
+        tag = self.tag
+        for raw in iter(stream.readline, b''):
+            text = raw.decode('utf-8', errors='replace').rstrip('\r\n')
+            if text.startswith(PHASE_MARKER):
+                tag = text[len(PHASE_MARKER):].strip() or self.tag
+                continue
+            self._emit(OutputLine(name, tag, text))
+        stream.close()
+
+    def _emit(self, line):
+        with self._lock:
+            if line.tag not in self._tails:
+                self._tails[line.tag] = deque(maxlen=self.tail_lines)
+            self._tails[line.tag].append(line)
+            # Sinks run under the lock so lines from different streams
+            # don't interleave mid-write.
+            for sink in list(self.sinks):
+                try:
+                    sink(line)
+                except Exception:
+                    # Keep draining the pipe no matter what a sink does,
+                    # or the process writing to it blocks forever.
+                    traceback.print_exc()
+                    print('Output sink {!r} failed and was removed.'.format(sink))
+                    self.sinks.remove(sink)
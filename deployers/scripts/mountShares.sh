@@ -3,7 +3,12 @@
 
 keyfile=$1
 
-sh cifsMount.sh
+# Exit status: non-zero if mounting failed on the master or any node
+status=0
+
+# Lines starting with "### " tag the output that follows with a node name
+echo "### master"; echo "### master" >&2
+sh cifsMount.sh || { echo "Mounting share failed on master" >&2; status=1; }
 
 # Install jq used for the next command
 sudo apt-get install -y jq
@@ -13,5 +18,9 @@ curl http://leader.mesos:1050/system/health/v1/nodes | jq '.nodes[].host_ip' | s
 
 # From the previous file created, run our script to mount our share on each node
 while read line; do
-    ssh `whoami`@$line -o StrictHostKeyChecking=no -i ${keyfile} < ./cifsMount.sh
-done < nodes
\ No newline at end of file
+    echo "### $line"; echo "### $line" >&2
+    ssh `whoami`@$line -o StrictHostKeyChecking=no -i ${keyfile} < ./cifsMount.sh \
+        || { echo "Mounting share failed on $line" >&2; status=1; }
+done < nodes
+
+exit $status
@@ -3,6 +3,7 @@
 
 import argparse
 import os
+import socket
 import sys
 from collections import namedtuple
 
@@ -12,6 +13,7 @@ from azure.common.credentials import ServicePrincipalCredentials
 
 from deployers.container_deployer import ContainerDeployer
 from deployers.acr_container_deployer import ACRContainerDeployer
+from deployers.helpers.journal_helper import DeployJournal
 
 
 DEFAULT_DOCKER_IMAGE = 'mesosphere/simple-docker'
@@ -40,34 +42,139 @@ def set_up_parser():
         default='{name}-group',
         help='Name of resource group to use. (If nonexistent it will be created.)'
     )
+    parser.add_argument(
+        '--journal', default=os.path.join('~', '.containersample', '{name}-journal.json'),
+        help='File recording completed deploy phases, used by --resume.'
+    )
+    parser.add_argument(
+        '--resume', action='store_true',
+        help='Skip deploy phases that the journal says already completed.'
+    )
+    parser.add_argument(
+        '--gc', action='store_true',
+        help='Instead of deploying, delete registry images and share files '
+             'no Marathon app uses. Requires --use-acr.'
+    )
+    parser.add_argument(
+        '--gc-keep', type=int, default=5,
+        help='Number of newest images per repository (and share files) --gc keeps.'
+    )
+    parser.add_argument(
+        '--gc-share-pattern',
+        help='Glob of share files --gc may delete. '
+             'Defaults to the Docker credentials archive this sample uploads.'
+    )
+    parser.add_argument(
+        '--dry-run', action='store_true',
+        help='With --gc, only report what would be deleted.'
+    )
+    parser.add_argument(
+        '--agent', action='store_true',
+        help='Send the deploy to a running deploy agent, if there is one.'
+    )
+    parser.add_argument(
+        '--serve-agent', action='store_true',
+        help='Run a deploy agent that keeps clients and tunnels warm between deploys.'
+    )
+    parser.add_argument(
+        '--agent-socket',
+        help='Unix socket the deploy agent listens on. '
+             'Defaults to ~/.containersample-agent.sock.'
+    )
+    parser.add_argument(
+        '--agent-idle-timeout', type=int, default=30 * 60,
+        help='Seconds without requests before the deploy agent exits.'
+    )
     return parser
 
 
-def main():
-    parser = set_up_parser()
-    args = parser.parse_args()
-
+def get_client_args():
     credentials = ServicePrincipalCredentials(
         client_id=os.environ['AZURE_CLIENT_ID'],
         secret=os.environ['AZURE_CLIENT_SECRET'],
         tenant=os.environ['AZURE_TENANT_ID'],
     )
+    return ClientArgs(
+        credentials,
+        os.environ['AZURE_SUBSCRIPTION_ID'],
+    )
 
-    deployer = args.deployer(
-        ClientArgs(
-            credentials,
-            os.environ['AZURE_SUBSCRIPTION_ID'],
-        ),
-        args.image,
-        resource_group=args.resource_group.format(name=args.name),
+
+def print_response(public_ip):
+    print('\nContacting ACS cluster at http://{}'.format(public_ip))
+    print('Response:')
+    print(requests.get('http://{}'.format(public_ip)).text)
+
+
+def main():
+    parser = set_up_parser()
+    args = parser.parse_args()
+
+    if (args.serve_agent or args.agent) and not hasattr(socket, 'AF_UNIX'):
+        if args.serve_agent:
+            parser.error('--serve-agent needs Unix socket support, '
+                         'which this platform lacks.')
+        print('Unix sockets are not available here; deploying directly.')
+        args.agent = False
+
+    if args.serve_agent:
+        # Imported here since the agent module needs Unix socket support.
+        from deployers import agent
+        agent.DeployAgent(
+            get_client_args(),
+            socket_path=args.agent_socket or agent.DEFAULT_SOCKET_PATH,
+            idle_timeout=args.agent_idle_timeout or None,
+        ).serve_forever()
+        return
+
+    resource_group = args.resource_group.format(name=args.name)
+    options = dict(
+        resource_group=resource_group,
         container_service=args.name + 'service',
         storage_account=args.name + 'storage',
         container_registry=args.name + 'registry',
     )
+    journal_path = os.path.abspath(os.path.expanduser(args.journal.format(name=args.name)))
+    journal_target = dict(
+        deployer=args.deployer.__name__,
+        image=args.image,
+        name=args.name,
+        resource_group=resource_group,
+    )
+
+    if args.gc:
+        if args.deployer is not ACRContainerDeployer:
+            parser.error('--gc requires --use-acr')
+        deployer = args.deployer(get_client_args(), args.image, **options)
+        deployer.collect_garbage(keep=args.gc_keep, dry_run=args.dry_run,
+                                 share_pattern=args.gc_share_pattern)
+        return
+
+    if args.agent:
+        from deployers import agent
+        agent_socket = args.agent_socket or agent.DEFAULT_SOCKET_PATH
+        if agent.ping(agent_socket):
+            print('Deploying through agent at', agent_socket)
+            result = agent.send_request(
+                agent_socket, 'deploy',
+                deployer=args.deployer.__name__,
+                image=args.image,
+                options=options,
+                journal=dict(path=journal_path, target=journal_target, resume=args.resume),
+            )
+            print_response(result['public_ip'])
+            return
+        print('No deploy agent at {}; deploying directly.'.format(agent_socket))
+
+    deployer = args.deployer(
+        get_client_args(),
+        args.image,
+        journal=DeployJournal(journal_path, journal_target, resume=args.resume),
+        **options
+    )
     deployer.deploy()
-    print('\nContacting ACS cluster at http://{}'.format(deployer.public_ip()))
-    print('Response:')
-    print(requests.get('http://{}'.format(deployer.public_ip())).text)
+    print_response(deployer.public_ip())
+
 
 if __name__ == '__main__':
     sys.exit(main())
@@ -0,0 +1,250 @@
+import unittest
+from types import SimpleNamespace
+
+from deployers.helpers.advanced.gc_helper import GarbageCollector, TAGS_ONLY_NOTE
+
+
+LOGIN_SERVER = 'sample.azurecr.io'
+
+
+def schema2(digest, created, layers):
+    """Build a fake schema 2 image: a config blob plus (digest, size) layers."""
+    return dict(
+        digest=digest,
+        created=created,
+        config={'digest': 'config-' + digest, 'size': 1},
+        layers=[{'digest': layer, 'size': size} for layer, size in layers],
+    )
+
+
+class FakeRegistry(object):
+    """Stands in for ContainerRegistryHelper, backed by a dict of repositories.
+
+    Each repository maps to a list of (tags, image) pairs. With acr=False
+    list_manifests() is unsupported, like a plain v2 registry.
+    """
+    credentials_file_name = 'docker.tar.gz'
+
+    def __init__(self, repositories, storage, acr=True):
+        self.repositories = repositories
+        self.storage = storage
+        self.acr = acr
+        self.registry = SimpleNamespace(login_server=LOGIN_SERVER)
+        self.deleted = []
+
+    def list_repositories(self):
+        return list(self.repositories)
+
+    def list_tags(self, repository):
+        return [tag for tags, _ in self.repositories[repository] for tag in tags]
+
+    def list_manifests(self, repository):
+        if not self.acr:
+            return None
+        return [
+            {'digest': image['digest'], 'tags': tags, 'createdTime': image.get('created', '')}
+            for tags, image in self.repositories[repository]
+        ]
+
+    def get_manifest(self, repository, reference):
+        for tags, image in self.repositories[repository]:
+            if reference == image['digest'] or reference in tags:
+                manifest = {key: image[key] for key in ('config', 'layers') if key in image}
+                manifest['digest'] = image['digest']
+                return manifest
+        raise KeyError(reference)
+
+    def get_blob(self, repository, digest):
+        for _, image in self.repositories[repository]:
+            if image.get('config', {}).get('digest') == digest:
+                return SimpleNamespace(json=lambda image=image: {'created': image['created']})
+        raise KeyError(digest)
+
+    def delete_manifest(self, repository, digest):
+        self.deleted.append((repository, digest))
+
+
+class FakeStorage(object):
+    default_share = 'share'
+
+    def __init__(self, files=None):
+        # name -> (last_modified, size)
+        self.files = files or {}
+        self.deleted = []
+
+    def list_files(self):
+        return [
+            SimpleNamespace(name=name, properties=SimpleNamespace(content_length=size))
+            for name, (_, size) in self.files.items()
+        ]
+
+    def get_file_properties(self, name):
+        return SimpleNamespace(last_modified=self.files[name][0])
+
+    def delete_file(self, name):
+        self.deleted.append(name)
+
+
+def app(image=None, uris=(), volumes=()):
+    return {
+        'container': {
+            'docker': {'image': image} if image else {},
+            'volumes': [{'hostPath': path} for path in volumes],
+        },
+        'uris': list(uris),
+    }
+
+
+class GarbageCollectorTest(unittest.TestCase):
+    def collect(self, repositories=None, files=None, apps=(), keep=1, acr=True,
+                dry_run=True, **kwargs):
+        self.storage = FakeStorage(files)
+        self.registry = FakeRegistry(repositories or {}, self.storage, acr=acr)
+        container_service = SimpleNamespace(marathon_apps=lambda: list(apps))
+        collector = GarbageCollector(container_service, self.registry, keep=keep, **kwargs)
+        return collector.collect(dry_run=dry_run)
+
+    @staticmethod
+    def names(report):
+        return sorted(candidate.name for candidate in report.candidates)
+
+    def test_keeps_newest_images_per_repository(self):
+        report = self.collect({
+            'user/app': [
+                (['v1'], schema2('d1', '2017-01-01', [('l1', 10)])),
+                (['v2'], schema2('d2', '2017-01-02', [('l2', 10)])),
+                (['v3'], schema2('d3', '2017-01-03', [('l3', 10)])),
+            ],
+            'user/other': [
+                (['v1'], schema2('o1', '2016-01-01', [('m1', 10)])),
+            ],
+        }, keep=2)
+        self.assertEqual(self.names(report), ['d1'])
+        self.assertEqual(report.kept, 3)
+
+    def test_keeps_images_referenced_by_apps(self):
+        report = self.collect({
+            'user/app': [
+                (['v1'], schema2('d1', '2017-01-01', [('l1', 10)])),
+                (['v2'], schema2('d2', '2017-01-02', [('l2', 10)])),
+                (['v3'], schema2('d3', '2017-01-03', [('l3', 10)])),
+            ],
+        }, apps=[
+            app(image='{}/user/app:v1'.format(LOGIN_SERVER)),
+            app(image='{}/user/app@d2'.format(LOGIN_SERVER)),
+        ], keep=0)
+        self.assertEqual(self.names(report), ['d3'])
+
+    def test_collects_untagged_manifests(self):
+        report = self.collect({
+            'user/simple-docker': [
+                ([], schema2('old', '2017-01-01', [('base', 100), ('l1', 10)])),
+                (['latest'], schema2('new', '2017-01-02', [('base', 100), ('l2', 10)])),
+            ],
+        }, apps=[app(image='{}/user/simple-docker'.format(LOGIN_SERVER))], keep=0)
+        self.assertEqual(self.names(report), ['old'])
+        self.assertEqual(report.candidates[0].tags, [])
+        # The base layer is still used by the kept image.
+        self.assertEqual(report.reclaimed, 11)
+        self.assertNotIn(TAGS_ONLY_NOTE, report.notes)
+
+    def test_tags_sharing_a_digest_are_one_candidate(self):
+        report = self.collect({
+            'user/app': [
+                (['v1', 'stable'], schema2('d1', '2017-01-01', [('l1', 10)])),
+                (['v2'], schema2('d2', '2017-01-02', [('l2', 10)])),
+            ],
+        }, acr=False)
+        self.assertEqual(len(report.candidates), 1)
+        self.assertEqual(report.candidates[0].name, 'd1')
+        self.assertEqual(sorted(report.candidates[0].tags), ['stable', 'v1'])
+        self.assertIn(TAGS_ONLY_NOTE, report.notes)
+
+    def test_tag_sharing_a_digest_with_a_referenced_tag_is_kept(self):
+        report = self.collect({
+            'user/app': [
+                (['v1', 'stable'], schema2('d1', '2017-01-01', [('l1', 10)])),
+                (['v2'], schema2('d2', '2017-01-02', [('l2', 10)])),
+            ],
+        }, apps=[app(image='{}/user/app:stable'.format(LOGIN_SERVER))], keep=0, acr=False)
+        self.assertEqual(self.names(report), ['d2'])
+
+    def test_shared_layers_are_counted_once(self):
+        report = self.collect({
+            'user/app': [
+                (['v1'], schema2('d1', '2017-01-01', [('base', 100), ('l1', 10)])),
+                (['v2'], schema2('d2', '2017-01-02', [('base', 100), ('l2', 10)])),
+            ],
+        }, keep=0)
+        self.assertEqual(report.reclaimed, 100 + 10 + 10 + 1 + 1)
+
+    def test_keeps_manifests_that_are_not_schema2(self):
+        for acr in (True, False):
+            report = self.collect({
+                'user/app': [
+                    (['old'], {'digest': 'd0', 'schemaVersion': 1}),
+                    (['list'], {'digest': None}),
+                    (['v1'], schema2('d1', '2017-01-01', [('l1', 10)])),
+                ],
+            }, keep=0, acr=acr)
+            self.assertEqual(self.names(report), ['d1'])
+            self.assertEqual(report.kept, 2)
+
+    def test_share_files_limited_to_pattern(self):
+        files = {
+            'docker.tar.gz': (1, 5),
+            'app-data.db': (0, 500),
+        }
+        report = self.collect(files=files, keep=0)
+        self.assertEqual(self.names(report), ['docker.tar.gz'])
+
+        report = self.collect(files=files, keep=0, share_pattern='*')
+        self.assertEqual(self.names(report), ['app-data.db', 'docker.tar.gz'])
+
+    def test_share_files_kept_by_reference_and_age(self):
+        files = {
+            'creds-1.tar.gz': (1, 5),
+            'creds-2.tar.gz': (2, 5),
+            'creds-3.tar.gz': (3, 5),
+            'creds-4.tar.gz': (4, 5),
+        }
+        report = self.collect(files=files, apps=[
+            app(uris=['file:///mnt/share/creds-1.tar.gz']),
+            app(volumes=['/mnt/share/creds-2.tar.gz']),
+        ], keep=1, share_pattern='creds-*')
+        self.assertEqual(self.names(report), ['creds-3.tar.gz'])
+
+    def test_volume_on_directory_keeps_its_top_level_entry(self):
+        report = self.collect(files={'data': (0, 5), 'other': (0, 5)}, apps=[
+            app(volumes=['/mnt/share/data/db/']),
+        ], keep=0, share_pattern='*')
+        self.assertEqual(self.names(report), ['other'])
+
+    def test_whole_share_volume_keeps_every_file(self):
+        report = self.collect(files={'docker.tar.gz': (0, 5), 'data': (0, 5)}, apps=[
+            app(volumes=['/mnt/share/']),
+        ], keep=0, share_pattern='*')
+        self.assertEqual(report.candidates, [])
+
+    def test_deletes_candidates_unless_dry_run(self):
+        repositories = {
+            'user/app': [
+                (['v1'], schema2('d1', '2017-01-01', [('l1', 10)])),
+                (['v2'], schema2('d2', '2017-01-02', [('l2', 10)])),
+            ],
+        }
+        files = {'docker.tar.gz': (0, 5), 'creds-old.tar.gz': (0, 5)}
+        self.collect(repositories, files, keep=1, share_pattern='*.tar.gz')
+        self.assertEqual(self.registry.deleted, [])
+        self.assertEqual(self.storage.deleted, [])
+
+        report = self.collect(repositories, {'docker.tar.gz': (1, 5), 'creds-old.tar.gz': (0, 5)},
+                              keep=1, share_pattern='*.tar.gz', dry_run=False)
+        self.assertEqual(self.registry.deleted, [('user/app', 'd1')])
+        self.assertEqual(self.storage.deleted, ['creds-old.tar.gz'])
+        self.assertEqual(len(report.deleted), 2)
+        self.assertEqual(report.reclaimed, 11 + 5)
+
+
+if __name__ == '__main__':
+    unittest.main()